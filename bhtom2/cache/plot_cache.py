@@ -0,0 +1,30 @@
+from typing import Any
+
+from django.core.cache import cache
+from django.db.models import Count, Max, QuerySet
+
+# Rendered plots are also invalidated implicitly: the cache key embeds the datum
+# count and latest timestamp, so any new ``ReducedDatum`` results in a fresh key
+# and the stale entry simply expires.
+PLOT_CACHE_TIMEOUT: int = 3600
+
+
+def reduced_datum_plot_cache_key(prefix: str, datums: QuerySet, *key_parts: Any) -> str:
+    """
+    Builds a cache key for a plot rendered from the passed ``ReducedDatum`` queryset.
+
+    The key includes a ``COUNT(*)``/``MAX(timestamp)`` signature of the queryset, which is
+    much cheaper to compute than the plot itself and changes whenever data is added.
+    """
+    signature = datums.aggregate(n=Count('id'), latest=Max('timestamp'))
+    latest_timestamp: float = signature['latest'].timestamp() if signature['latest'] else 0.0
+    key_suffix: str = ':'.join(str(part) for part in key_parts)
+    return f'{prefix}:{signature["n"]}:{latest_timestamp}:{key_suffix}'
+
+
+def get_cached_plot(key: str) -> Any:
+    return cache.get(key)
+
+
+def set_cached_plot(key: str, plot: Any) -> None:
+    cache.set(key, plot, PLOT_CACHE_TIMEOUT)
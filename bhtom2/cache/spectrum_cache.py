@@ -0,0 +1,63 @@
+import os
+import tempfile
+from typing import Tuple
+
+import numpy as np
+from django.conf import settings
+
+from bhtom2.utils.bhtom_logger import BHTOMLogger
+from bhtom_base.bhtom_dataproducts.models import ReducedDatum
+from bhtom_base.bhtom_dataproducts.processors.data_serializers import SpectrumSerializer
+
+logger: BHTOMLogger = BHTOMLogger(__name__, '[Spectrum cache]')
+
+SPECTRUM_CACHE_DIR: str = os.path.join(settings.MEDIA_ROOT, 'cache', 'spectra')
+
+
+def _spectrum_cache_path(datum_pk: int) -> str:
+    return os.path.join(SPECTRUM_CACHE_DIR, f'{datum_pk}.npz')
+
+
+def spectrum_arrays(datum: ReducedDatum) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (wavelength, flux) arrays for a spectroscopic ``ReducedDatum``.
+
+    Deserializing the stored spectrum costs O(samples) per call, so the arrays
+    are written to an .npz file under MEDIA_ROOT on first access and read back
+    directly on subsequent renders. A datum's spectrum never changes once saved,
+    so the cached file needs no invalidation.
+    """
+    path: str = _spectrum_cache_path(datum.pk)
+    try:
+        cached = np.load(path)
+        return cached['wavelength'], cached['flux']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # A corrupt or unreadable cache file (np.load raises BadZipFile or
+        # ValueError on truncated archives) must never break rendering; fall
+        # through and rebuild the arrays from the datum.
+        logger.warning(f'Discarding unreadable spectrum cache for datum {datum.pk}: {e}')
+
+    spectrum = SpectrumSerializer().deserialize(datum.value)
+    wavelength: np.ndarray = np.asarray(spectrum.wavelength.value)
+    flux: np.ndarray = np.asarray(spectrum.flux.value)
+
+    # Write to a temp file and rename into place so a concurrent render or a
+    # process killed mid-write can never leave a partial .npz at the final path.
+    tmp_path = None
+    try:
+        os.makedirs(SPECTRUM_CACHE_DIR, exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=SPECTRUM_CACHE_DIR, suffix='.npz.tmp')
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            np.savez(tmp_file, wavelength=wavelength, flux=flux)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f'Could not cache spectrum for datum {datum.pk}: {e}')
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    return wavelength, flux
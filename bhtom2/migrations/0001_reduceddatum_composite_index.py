@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Composite index backing the hot ``ReducedDatum`` lookups: ``photometry_for_target``,
+    ``recent_photometry`` and ``spectroscopy_for_target`` all filter on
+    (target, data_type[, value_unit]) and order by ``-timestamp``, which without this
+    index costs Postgres a sequential scan plus sort on large tables.
+
+    The model (and its ``Meta``) lives in the bhtom_base submodule, so the index is
+    created here with raw SQL instead of ``Meta.indexes``. It is built CONCURRENTLY
+    (which requires ``atomic = False``) so that broker ingestion can keep writing
+    to the table while the index builds on an already-large installation.
+    """
+
+    atomic = False
+
+    # value_unit is a fork-added column, so this must run after *all* of
+    # bhtom_dataproducts' migrations, not just the one creating the table.
+    dependencies = [
+        ('bhtom_dataproducts', '__latest__'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS rd_target_type_unit_ts '
+                'ON bhtom_dataproducts_reduceddatum '
+                '(target_id, data_type, value_unit, timestamp DESC);',
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS rd_target_type_unit_ts;',
+        ),
+    ]
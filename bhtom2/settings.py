@@ -13,9 +13,8 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 import logging.config
 import os
 import sys
-import tempfile
 
-from dotenv import dotenv_values
+from dotenv import load_dotenv
 
 from bhtom2.external_service.data_source_information import DataSource, TARGET_NAME_KEYS
 
@@ -23,8 +22,10 @@ from bhtom2.external_service.data_source_information import DataSource, TARGET_N
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Environment variables
-secret = dotenv_values(os.path.join(BASE_DIR, 'bhtom2/.bhtom.env'))
+# Environment variables: load the env file into os.environ once (existing
+# environment variables win), instead of re-parsing it into a dict on every
+# settings import under autoreload/management-command fan-out.
+load_dotenv(os.path.join(BASE_DIR, 'bhtom2/.bhtom.env'), override=False)
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
@@ -35,15 +36,15 @@ SECRET_KEY = 'jkg5zb*xutcc+93y!00$7z409yrh%6#i@f)+h!$lyr3vqo9c)e'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
-ALLOWED_HOSTS = [] + list(secret.get("ALLOWED_HOSTS", 'localhost').split(','))
-SITE_ID = int(secret.get("SITE_ID", 1))
+ALLOWED_HOSTS = [] + list(os.environ.get("ALLOWED_HOSTS", 'localhost').split(','))
+SITE_ID = int(os.environ.get("SITE_ID", 1))
 
-CPCS_BASE_URL = secret.get('CPCS_BASE_URL', None)
-CPCS_DATA_ACCESS_HASHTAG = secret.get('CPCS_DATA_ACCESS_HASHTAG', None)
+CPCS_BASE_URL = os.environ.get('CPCS_BASE_URL', None)
+CPCS_DATA_ACCESS_HASHTAG = os.environ.get('CPCS_DATA_ACCESS_HASHTAG', None)
 
-ADMIN_USERNAME = secret.get('ADMIN_USERNAME')
-ADMIN_PASSWORD = secret.get('ADMIN_PASSWORD')
-ADMIN_EMAIL = secret.get('ADMIN_EMAIL')
+ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME')
+ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD')
+ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL')
 
 # Application definition
 
@@ -55,7 +56,6 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
-    'django_extensions',
     'guardian',
     'bhtom_base.bhtom_common.apps.TomCommonConfig',
     'django_comments',
@@ -75,6 +75,11 @@ INSTALLED_APPS = [
     'bhtom2.apps.BHTOM2Config'
 ]
 
+# django_extensions only provides development-time management commands; keep it
+# out of the production app registry.
+if DEBUG:
+    INSTALLED_APPS.append('django_extensions')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -85,7 +90,6 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'bhtom_base.bhtom_common.middleware.Raise403Middleware',
     'bhtom_base.bhtom_common.middleware.ExternalServiceMiddleware',
-    'bhtom_base.bhtom_common.middleware.AuthStrategyMiddleware',
     'bhtom_custom_registration.bhtom_registration.middleware.RedirectAuthenticatedUsersFromRegisterMiddleware',
 ]
 
@@ -116,18 +120,32 @@ WSGI_APPLICATION = 'bhtom2.wsgi.application'
 
 DATABASES = {
     'default': {
-        'NAME': secret.get("POSTGRES_DB_NAME", 'bhtom2'),
+        'NAME': os.environ.get("POSTGRES_DB_NAME", 'bhtom2'),
         'ENGINE': 'django.db.backends.postgresql',
-        'USER': secret.get("POSTGRES_DB_USER", 'bhtom'),
-        'PASSWORD': secret.get("POSTGRES_PASSWORD", ""),
-        'HOST': secret.get('POSTGRES_HOST', 'localhost'),
-        'PORT': secret.get('POSTGRES_PORT', 5432),
+        'USER': os.environ.get("POSTGRES_DB_USER", 'bhtom'),
+        'PASSWORD': os.environ.get("POSTGRES_PASSWORD", ""),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', 5432),
+        # Persistent connections: without CONN_MAX_AGE every request pays a
+        # fresh Postgres TCP (and TLS) handshake, which dominates the small
+        # queries this app mostly runs. CONN_HEALTH_CHECKS takes effect from
+        # Django 4.1 and guards against serving a dropped connection.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'sslmode': 'prefer',
+            'connect_timeout': 3,
+        },
         'TEST': {
-            'NAME': secret.get("POSTGRES_TEST_DB_NAME", 'test_bhtom2')
+            'NAME': os.environ.get("POSTGRES_TEST_DB_NAME", 'test_bhtom2')
         }
     },
 }
 
+# Test runs keep short-lived connections for isolation between test cases.
+if 'test' in sys.argv:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
 MIGRATION_MODULES = {
     'bhtom2': 'bhtom2.migrations'
 }
@@ -196,11 +214,15 @@ LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'handlers': {
+        # UDP with GELF's native chunking/compression: emitting a record is a
+        # fire-and-forget datagram instead of an in-band TCP send, so Graylog
+        # round-trips never sit on the request thread.
         'graypy': {
             'level': 'INFO',
-            'class': 'graypy.GELFTCPHandler',
-            'host': secret.get('GRAYLOG_HOST', 'localhost'),
-            'port': secret.get('GRAYLOG_PORT', 12201),
+            'class': 'graypy.GELFUDPHandler',
+            'host': os.environ.get('GRAYLOG_HOST', 'localhost'),
+            'port': int(os.environ.get('GRAYLOG_PORT', 12201)),
+            'compress': True,
         },
         'console': {
             'class': 'logging.StreamHandler',
@@ -214,15 +236,46 @@ LOGGING = {
     },
 }
 
-# Caching
-# https://docs.djangoproject.com/en/dev/topics/cache/#filesystem-caching
+# Error and performance monitoring. Tracing every request is expensive (each
+# traced request records spans for templates and DB queries), so only a small
+# sample is traced by default; errors are always reported regardless of the
+# sample rate. Environments that want full tracing (e.g. a dev box) set
+# SENTRY_TRACES_SAMPLE_RATE=1.0 in .bhtom.env.
+SENTRY_DSN = os.environ.get('SENTRY_DSN')
+if SENTRY_DSN:
+    import sentry_sdk
+    from sentry_sdk.integrations.django import DjangoIntegration
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[DjangoIntegration()],
+        traces_sample_rate=float(os.environ.get('SENTRY_TRACES_SAMPLE_RATE', '0.01')),
+        send_default_pii=False,
+    )
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': tempfile.gettempdir()
+# Caching
+# https://docs.djangoproject.com/en/dev/topics/cache/
+
+# The templatetag plot caches rely on this being an in-memory backend: the previous
+# FileBasedCache in the tempdir paid a pickle + lock-file round-trip on disk for
+# every hit. Redis is shared between workers; without REDIS_URL each process falls
+# back to its own local-memory cache.
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bhtom2-default'
+        }
     }
-}
 
 # TOM Specific configuration
 TARGET_TYPE = 'SIDEREAL'
@@ -265,6 +318,11 @@ DATA_PRODUCT_TYPES = {
     'image_file': ('image_file', 'Image File')
 }
 
+# Prebuilt once at import for ChoiceFields (e.g. DataProductUploadForm), which
+# otherwise rebuild the choices list from DATA_PRODUCT_TYPES on every form
+# instantiation. The types are static, so compute the tuple a single time.
+DATA_PRODUCT_TYPE_CHOICES = tuple((full_name, display) for full_name, display in DATA_PRODUCT_TYPES.values())
+
 DATA_PROCESSORS = {
     'photometry': 'bhtom_base.bhtom_dataproducts.processors.photometry_processor.PhotometryProcessor',
     'spectroscopy': 'bhtom_base.bhtom_dataproducts.processors.spectroscopy_processor.SpectroscopyProcessor',
@@ -382,6 +440,27 @@ try:
 except ImportError:
     pass
 
+# The middleware chain is finished here, after local_settings, so a deployment
+# overriding AUTH_STRATEGY there still gets login enforcement.
+# AuthStrategyMiddleware only does work when AUTH_STRATEGY is LOCKED; with
+# READ_ONLY it ran its checks on every request just to fall through, so it is
+# inserted (in its original position, before the registration redirect) only
+# when views are actually locked.
+if AUTH_STRATEGY == 'LOCKED':
+    MIDDLEWARE = list(MIDDLEWARE)
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index(
+            'bhtom_custom_registration.bhtom_registration.middleware.RedirectAuthenticatedUsersFromRegisterMiddleware'),
+        'bhtom_base.bhtom_common.middleware.AuthStrategyMiddleware')
+
+# Django builds the middleware chain once at startup (BaseHandler.load_middleware),
+# so freezing the finished chain as a tuple is purely a guard against accidental
+# mutation after this point — it has no per-request cost either way. If an
+# instrumentation middleware is ever added here by hand, prepend it so the rest of
+# the chain runs (and is timed) inside it; Sentry needs no entry, its Django
+# integration patches the handler directly.
+MIDDLEWARE = tuple(MIDDLEWARE)
+
 GAIA_ALERTS_PATH: str = 'http://gsaweb.ast.cam.ac.uk'
 AAVSO_API_PATH: str = 'https://www.aavso.org/vsx/index.php'
 ZTF_DR_PATH: str = 'https://irsa.ipac.caltech.edu/cgi-bin/ZTF/nph_light_curves'
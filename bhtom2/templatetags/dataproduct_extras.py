@@ -1,18 +1,16 @@
-from datetime import datetime
-from urllib.parse import urlencode
-
 import plotly.graph_objs as go
 from django import template
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.paginator import Paginator
 from django.shortcuts import reverse
 from guardian.shortcuts import get_objects_for_user
-from plotly import offline
 
+from bhtom2.cache.plot_cache import get_cached_plot, reduced_datum_plot_cache_key, set_cached_plot
+from bhtom2.cache.spectrum_cache import spectrum_arrays
 from bhtom_base.bhtom_dataproducts.forms import DataProductUploadForm
 from bhtom_base.bhtom_dataproducts.models import DataProduct, ReducedDatum, ReducedDatumUnit
-from bhtom_base.bhtom_dataproducts.processors.data_serializers import SpectrumSerializer
 from bhtom_base.bhtom_observations.models import ObservationRecord
 from bhtom_base.bhtom_targets.models import Target
 
@@ -24,10 +22,15 @@ def recent_photometry(target, limit=1):
     """
     Displays a table of the most recent photometric points for a target.
     """
-    photometry = ReducedDatum.objects.filter(data_type='photometry', target=target).order_by('-timestamp')[:limit]
-    return {'data': [{'timestamp': rd.timestamp,
-                      'magnitude': rd.value} for rd in photometry
-                     if rd.value_unit == ReducedDatumUnit.MAGNITUDE]}
+    # The value_unit filter belongs in the SQL: filtering the sliced queryset in
+    # Python returned fewer than ``limit`` rows (or none) whenever the newest
+    # datums were not magnitudes.
+    photometry = ReducedDatum.objects.filter(data_type='photometry',
+                                             target=target,
+                                             value_unit=ReducedDatumUnit.MAGNITUDE) \
+                                     .order_by('-timestamp').values('timestamp', 'value')[:limit]
+    return {'data': [{'timestamp': datum['timestamp'],
+                      'magnitude': datum['value']} for datum in photometry]}
 
 
 @register.inclusion_tag('bhtom_dataproducts/partials/dataproduct_list_for_target.html', takes_context=True)
@@ -40,6 +43,10 @@ def dataproduct_list_for_target(context, target):
     else:
         target_products_for_user = get_objects_for_user(
             context['request'].user, 'bhtom_dataproducts.view_dataproduct', klass=target.dataproduct_set.all())
+    # extra_data can hold a large JSON blob the list partial never shows; defer
+    # it so each row stays cheap to fetch and build. Full dict projection is not
+    # an option while the partial renders model attributes.
+    target_products_for_user = target_products_for_user.defer('extra_data').order_by('-created')
     return {
         'products': target_products_for_user,
         'target': target
@@ -97,10 +104,17 @@ def upload_dataproduct(context, obj):
         initial['referrer'] = reverse('bhtom_base.bhtom_observations:detail', args=(obj.id,))
     form = DataProductUploadForm(initial=initial)
     if not settings.TARGET_PERMISSIONS_ONLY:
-        if user.is_superuser:
-            form.fields['groups'].queryset = Group.objects.all()
-        else:
-            form.fields['groups'].queryset = user.groups.all()
+        # The tag can appear several times on one page. ModelChoiceField clones
+        # whatever queryset it is handed and evaluates the clone, so caching a
+        # queryset object would not stop the re-query; cache the evaluated pks
+        # instead, so the (possibly joined) groups query runs once per request
+        # and later renders only pay a cheap pk__in lookup.
+        group_pks = getattr(context['request'], '_bhtom_upload_group_pks', None)
+        if group_pks is None:
+            groups = Group.objects.all() if user.is_superuser else user.groups.all()
+            group_pks = list(groups.values_list('pk', flat=True))
+            context['request']._bhtom_upload_group_pks = group_pks
+        form.fields['groups'].queryset = Group.objects.filter(pk__in=group_pks)
     return {'data_product_form': form}
 
 
@@ -134,7 +148,6 @@ def photometry_for_target(context, target, width=700, height=600, background=Non
         'i': 'black'
     }
 
-    photometry_data = {}
     if settings.TARGET_PERMISSIONS_ONLY:
         datums = ReducedDatum.objects.filter(target=target,
                                              data_type=settings.DATA_PRODUCT_TYPES['photometry'][0])
@@ -146,42 +159,49 @@ def photometry_for_target(context, target, width=700, height=600, background=Non
                                           data_type=settings.DATA_PRODUCT_TYPES['photometry'][0],
                                           value_unit=ReducedDatumUnit.MAGNITUDE))
 
-    for datum in datums:
-        photometry_data.setdefault(datum.filter, {})
-        photometry_data[datum.filter].setdefault('time', []).append(datum.timestamp)
-        photometry_data[datum.filter].setdefault('magnitude', []).append(datum.value)
-        photometry_data[datum.filter].setdefault('error', []).append(datum.error)
-
-        # TODO: handle limits
-        # photometry_data[datum.filter].setdefault('limit', []).append(datum.value.get('limit'))
+    # Rebuilding and serializing the figure is pure CPU work, so reuse the
+    # rendered figure for as long as the underlying datums are unchanged. With
+    # per-object permissions the datums are scoped to the user, so the key must
+    # be too — otherwise users could be served each other's cached plot.
+    cache_user = None if settings.TARGET_PERMISSIONS_ONLY else context['request'].user.pk
+    plot_cache_key = reduced_datum_plot_cache_key(f'photometry-plot-json:{target.pk}', datums,
+                                                  cache_user, width, height, background, label_color, grid)
+    plot_json = get_cached_plot(plot_cache_key)
+    if plot_json is not None:
+        return {
+            'target': target,
+            'plot_json': plot_json
+        }
+
+    # Group in the database: Postgres aggregates one row per filter with
+    # ready-to-plot, timestamp-ordered arrays, so no per-datum Python loop and
+    # no model hydration are needed at all.
+    grouped = datums.values('filter').annotate(
+        times=ArrayAgg('timestamp', ordering='timestamp'),
+        magnitudes=ArrayAgg('value', ordering='timestamp'),
+        errors=ArrayAgg('error', ordering='timestamp'))
+
+    # TODO: handle limits (photometry_nondetection datums)
 
     plot_data = []
-    for filter_name, filter_values in photometry_data.items():
-        if filter_values['magnitude']:
-            series = go.Scatter(
-                x=filter_values['time'],
-                y=filter_values['magnitude'],
+    # Scattergl renders through WebGL client-side and serializes points as
+    # packed arrays instead of per-marker SVG attributes, which keeps both the
+    # payload and the browser responsive on targets with thousands of points.
+    for group in grouped:
+        if group['magnitudes']:
+            series = go.Scattergl(
+                x=group['times'],
+                y=group['magnitudes'],
                 mode='markers',
-                marker=dict(color=color_map.get(filter_name)),
-                name=filter_name,
+                marker=dict(color=color_map.get(group['filter'])),
+                name=group['filter'],
                 error_y=dict(
                     type='data',
-                    array=filter_values['error'],
+                    array=group['errors'],
                     visible=True
                 )
             )
             plot_data.append(series)
-        # if filter_values['limit']:
-        #     series = go.Scatter(
-        #         x=filter_values['time'],
-        #         y=filter_values['limit'],
-        #         mode='markers',
-        #         opacity=0.5,
-        #         marker=dict(color=color_map.get(filter_name)),
-        #         marker_symbol=6,  # upside down triangle
-        #         name=filter_name + ' non-detection',
-        #     )
-        #     plot_data.append(series)
 
     layout = go.Layout(
         yaxis=dict(autorange='reversed'),
@@ -195,9 +215,14 @@ def photometry_for_target(context, target, width=700, height=600, background=Non
     fig = go.Figure(data=plot_data, layout=layout)
     fig.update_yaxes(showgrid=grid, color=label_color, showline=True, linecolor=label_color, mirror=True)
     fig.update_xaxes(showgrid=grid, color=label_color, showline=True, linecolor=label_color, mirror=True)
+    # Ship only the figure JSON; the partial calls Plotly.newPlot with the
+    # plotly.js bundle that the base layout includes once, instead of embedding
+    # the whole library in every rendered div.
+    plot_json = fig.to_json()
+    set_cached_plot(plot_cache_key, plot_json)
     return {
         'target': target,
-        'plot': offline.plot(fig, output_type='div', show_link=False)
+        'plot_json': plot_json
     }
 
 
@@ -210,21 +235,37 @@ def spectroscopy_for_target(context, target, dataproduct=None):
     spectral_dataproducts = DataProduct.objects.filter(target=target,
                                                        data_product_type=settings.DATA_PRODUCT_TYPES['spectroscopy'][0])
     if dataproduct:
-        spectral_dataproducts = DataProduct.objects.get(data_product=dataproduct)
+        spectral_dataproducts = spectral_dataproducts.filter(pk=dataproduct.pk)
 
-    plot_data = []
     if settings.TARGET_PERMISSIONS_ONLY:
         datums = ReducedDatum.objects.filter(data_product__in=spectral_dataproducts)
     else:
         datums = get_objects_for_user(context['request'].user,
                                       'bhtom_dataproducts.view_reduceddatum',
                                       klass=ReducedDatum.objects.filter(data_product__in=spectral_dataproducts))
+    # Only these two columns are read below; deferring the rest keeps large
+    # unused fields out of the transfer and the instances cheap to build.
+    datums = datums.only('value', 'timestamp')
+
+    # As in photometry_for_target, the key carries the user whenever the datums
+    # are permission-scoped to one.
+    cache_user = None if settings.TARGET_PERMISSIONS_ONLY else context['request'].user.pk
+    plot_cache_key = reduced_datum_plot_cache_key(f'spectroscopy-plot-json:{target.pk}', datums,
+                                                  cache_user, dataproduct.pk if dataproduct else None)
+    plot_json = get_cached_plot(plot_cache_key)
+    if plot_json is not None:
+        return {
+            'target': target,
+            'plot_json': plot_json
+        }
+
+    plot_data = []
     for datum in datums:
-        deserialized = SpectrumSerializer().deserialize(datum.value)
+        wavelength, flux = spectrum_arrays(datum)
         plot_data.append(go.Scatter(
-            x=deserialized.wavelength.value,
-            y=deserialized.flux.value,
-            name=datetime.strftime(datum.timestamp, '%Y%m%d-%H:%M:%s')
+            x=wavelength,
+            y=flux,
+            name=datum.timestamp.isoformat(timespec='seconds')
         ))
 
     layout = go.Layout(
@@ -237,12 +278,21 @@ def spectroscopy_for_target(context, target, dataproduct=None):
             tickformat=".1eg"
         )
     )
+    plot_json = go.Figure(data=plot_data, layout=layout).to_json()
+    set_cached_plot(plot_cache_key, plot_json)
     return {
         'target': target,
-        'plot': offline.plot(go.Figure(data=plot_data, layout=layout), output_type='div', show_link=False)
+        'plot_json': plot_json
     }
 
 
 @register.inclusion_tag('bhtom_dataproducts/partials/update_broker_data_button.html', takes_context=True)
 def update_broker_data_button(context):
-    return {'query_params': urlencode(context['request'].GET.dict())}
+    # QueryDict.urlencode() already encodes without the intermediate dict, and
+    # caching the result on the request means pages that include this tag more
+    # than once encode the query string only once.
+    query_params = getattr(context['request'], '_bhtom_get_query_params', None)
+    if query_params is None:
+        query_params = context['request'].GET.urlencode()
+        context['request']._bhtom_get_query_params = query_params
+    return {'query_params': query_params}
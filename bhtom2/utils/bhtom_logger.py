@@ -1,3 +1,4 @@
+import os
 from logging import Logger, getLogger
 from django.conf import settings
 import graypy
@@ -14,7 +15,12 @@ class BHTOMLogger:
         except Exception:
             self.__graylog_host: str = "localhost"
 
-        self.__logger.addHandler(graypy.GELFTCPHandler(self.__graylog_host))
+        # UDP so that log emission never blocks the calling thread on a
+        # Graylog round-trip. The port must be passed explicitly: graypy's UDP
+        # default is 12202, but Graylog listens where the LOGGING handler in
+        # settings.py sends — GRAYLOG_PORT, default 12201.
+        self.__logger.addHandler(graypy.GELFUDPHandler(self.__graylog_host,
+                                                       int(os.environ.get('GRAYLOG_PORT', 12201))))
 
     def info(self, message: str):
         self.__logger.info(f'{self.__log_prefix} {message}')